@@ -0,0 +1,108 @@
+"""Build dos assets estáticos (`flask build-assets`).
+
+Compila o CSS do Tailwind, baixa o Alpine e as fontes e grava tudo em
+ASSETS_DIR com o hash do conteúdo no nome, junto do manifest.json que o app
+lê na inicialização. Só o comando importa este módulo.
+"""
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import urllib.parse
+import urllib.request
+
+import click
+from flask import current_app
+
+from app import carregar_manifesto
+
+ALPINE_URL = 'https://cdn.jsdelivr.net/npm/alpinejs@3.14.1/dist/cdn.min.js'
+FONTES_URLS = [
+    'https://fonts.googleapis.com/css2?family=Manrope:wght@400;500;600;700;800&display=swap',
+    'https://fonts.googleapis.com/css2?family=Inter:wght@400;500;600;700&display=swap',
+    'https://fonts.googleapis.com/css2?family=Material+Symbols+Outlined',
+]
+# O Google Fonts só entrega woff2 para navegadores que ele reconhece.
+NAVEGADOR_FONTES = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                    '(KHTML, like Gecko) Chrome/124.0 Safari/537.36')
+EXTENSOES_COMPRIMIVEIS = ('.css', '.js', '.svg', '.json')
+
+try:
+    import brotli
+except ImportError:  # sem o pacote, só as versões .gz são geradas
+    brotli = None
+
+def _gravar_com_hash(pasta, nome, conteudo):
+    """Grava `conteudo` como nome.<hash>.ext, junto das versões .gz e .br."""
+    base, extensao = os.path.splitext(nome)
+    final = f"{base}.{hashlib.sha256(conteudo).hexdigest()[:12]}{extensao}"
+    caminho = os.path.join(pasta, final)
+    with open(caminho, 'wb') as arquivo:
+        arquivo.write(conteudo)
+    if extensao in EXTENSOES_COMPRIMIVEIS:
+        with open(caminho + '.gz', 'wb') as arquivo:
+            arquivo.write(gzip.compress(conteudo, compresslevel=9, mtime=0))
+        if brotli is not None:
+            with open(caminho + '.br', 'wb') as arquivo:
+                arquivo.write(brotli.compress(conteudo, quality=11))
+    return final
+
+def _baixar(url, cabecalhos=None):
+    pedido = urllib.request.Request(url, headers=cabecalhos or {})
+    with urllib.request.urlopen(pedido, timeout=30) as resposta:
+        return resposta.read()
+
+def compilar_css():
+    """Roda o Tailwind CLI sobre os templates e devolve o CSS minificado.
+
+    Usa o executável standalone (sem Node), que já traz os plugins forms e
+    container-queries. O caminho pode ser trocado com TAILWIND_CLI.
+    """
+    cli = shutil.which(current_app.config['TAILWIND_CLI'])
+    if cli is None:
+        raise click.ClickException(
+            f"Tailwind CLI '{current_app.config['TAILWIND_CLI']}' não encontrado. Baixe o executável em "
+            "https://github.com/tailwindlabs/tailwindcss/releases e defina TAILWIND_CLI.")
+    with tempfile.TemporaryDirectory() as pasta:
+        saida = os.path.join(pasta, 'app.css')
+        subprocess.run(
+            [cli, '-c', 'tailwind.config.js', '-i', os.path.join('static', 'src', 'app.css'),
+             '-o', saida, '--minify'],
+            cwd=current_app.root_path, check=True, capture_output=True)
+        with open(saida, 'rb') as arquivo:
+            return arquivo.read()
+
+def baixar_fontes(pasta):
+    """Baixa o CSS das fontes e os woff2 que ele usa, apontando tudo para /assets."""
+    def trocar(encontrado):
+        extensao = os.path.splitext(urllib.parse.urlparse(encontrado.group(1)).path)[1]
+        nome = _gravar_com_hash(pasta, 'fonte' + extensao, _baixar(encontrado.group(1)))
+        return f"url({nome})"  # relativo: o CSS e as fontes ficam na mesma pasta
+
+    partes = []
+    for url in FONTES_URLS:
+        css = _baixar(url, {'User-Agent': NAVEGADOR_FONTES}).decode('utf-8')
+        partes.append(re.sub(r"url\((https://[^)]+)\)", trocar, css))
+    return '\n'.join(partes).encode('utf-8')
+
+def gerar_assets():
+    """Compila o CSS, baixa Alpine e fontes e grava o manifesto novo."""
+    pasta = current_app.config['ASSETS_DIR']
+    os.makedirs(pasta, exist_ok=True)
+    manifesto = {
+        'app.css': _gravar_com_hash(pasta, 'app.css', compilar_css()),
+        'alpine.js': _gravar_com_hash(pasta, 'alpine.js', _baixar(ALPINE_URL)),
+        'fonts.css': _gravar_com_hash(pasta, 'fonts.css', baixar_fontes(pasta)),
+    }
+    # Os arquivos de builds anteriores ficam: páginas abertas com o HTML antigo
+    # ainda conseguem carregá-los. Só o manifesto é trocado, de uma vez.
+    temporario = os.path.join(pasta, 'manifest.json.tmp')
+    with open(temporario, 'w', encoding='utf-8') as arquivo:
+        json.dump(manifesto, arquivo, indent=2)
+    os.replace(temporario, os.path.join(pasta, 'manifest.json'))
+    carregar_manifesto()
+    return manifesto
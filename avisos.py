@@ -0,0 +1,488 @@
+"""Avisos em massa e lembretes de vencimento.
+
+Carregado sob demanda: só as rotas de aviso, o agendador de lembretes e os
+comandos importam este módulo.
+"""
+import datetime
+import logging
+import os
+import queue
+import random
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import insert, literal, or_, select, update
+
+from app import db, User, Assinatura, AvisoEnvio, AvisoDestinatario, Lembrete
+
+# --- 1. ENVIO DE AVISOS EM MASSA ---
+
+class TransporteStub:
+    """Transporte local que não envia nada de verdade.
+
+    Simula a latência (em segundos) e uma taxa de falhas de um provedor real,
+    para medir a vazão do pipeline sem rede.
+    """
+
+    def __init__(self, latencia=0.0, taxa_falha=0.0):
+        self.latencia = latencia
+        self.taxa_falha = taxa_falha
+
+    def enviar(self, telefone, mensagem):
+        if self.latencia:
+            time.sleep(self.latencia)
+        if self.taxa_falha and random.random() < self.taxa_falha:
+            raise RuntimeError('falha simulada no transporte')
+        # Roda nas threads do pool, fora do contexto do app: o logger do app pelo nome.
+        logging.getLogger('app').debug('Aviso para %s: %s', telefone, mensagem)
+
+def transporte_configurado():
+    """O AVISO_TRANSPORTE do app; sem nenhum configurado, um TransporteStub."""
+    return current_app.config.setdefault('AVISO_TRANSPORTE', TransporteStub())
+
+class LimitadorTaxa:
+    """Token bucket simples, compartilhado pelas threads de envio."""
+
+    def __init__(self, por_segundo):
+        self.por_segundo = por_segundo
+        self.fichas = por_segundo
+        self.ultimo = time.monotonic()
+        self.trava = threading.Lock()
+
+    def aguardar(self):
+        if not self.por_segundo:
+            return
+        while True:
+            with self.trava:
+                agora = time.monotonic()
+                self.fichas = min(self.por_segundo, self.fichas + (agora - self.ultimo) * self.por_segundo)
+                self.ultimo = agora
+                if self.fichas >= 1:
+                    self.fichas -= 1
+                    return
+                espera = (1 - self.fichas) / self.por_segundo
+            time.sleep(espera)
+
+def _enviar_com_retentativas(transporte, limitador, telefone, mensagem, tentativas):
+    erro = None
+    for tentativa in range(1, tentativas + 1):
+        limitador.aguardar()
+        try:
+            transporte.enviar(telefone, mensagem)
+            return True, tentativa, None
+        except Exception as e:
+            erro = str(e)[:255]
+            time.sleep(min(0.1 * 2 ** (tentativa - 1), 2.0))
+    return False, tentativas, erro
+
+# Pedido de parada: `parar_envios` o liga na saída do processo, e o envio em
+# andamento termina o lote atual e libera a reserva.
+_parar_avisos = threading.Event()
+
+def _dono():
+    # Calculado a cada chamada: depois do fork o pid do worker é outro.
+    return f'{socket.gethostname()}:{os.getpid()}'[:64]
+
+def _reservar_envio(envio_id, dono):
+    """Marca o envio como `enviando` para `dono`, se ninguém estiver com ele.
+
+    O UPDATE só pega envios inacabados cuja reserva está livre ou vencida, então
+    dois workers nunca enviam o mesmo aviso ao mesmo tempo.
+    """
+    agora = datetime.datetime.utcnow()
+    resultado = db.session.execute(
+        update(AvisoEnvio)
+        .where(AvisoEnvio.id == envio_id,
+               AvisoEnvio.status.in_(['na_fila', 'enviando', 'falhou']),
+               or_(AvisoEnvio.ativo_ate.is_(None), AvisoEnvio.ativo_ate < agora))
+        .values(status='enviando', dono=dono,
+                ativo_ate=agora + datetime.timedelta(seconds=current_app.config['AVISO_PRAZO']))
+    )
+    db.session.commit()
+    return resultado.rowcount == 1
+
+def _renovar_reserva(envio_id, dono):
+    resultado = db.session.execute(
+        update(AvisoEnvio)
+        .where(AvisoEnvio.id == envio_id, AvisoEnvio.dono == dono)
+        .values(ativo_ate=datetime.datetime.utcnow() + datetime.timedelta(seconds=current_app.config['AVISO_PRAZO']))
+    )
+    db.session.commit()
+    return resultado.rowcount == 1
+
+def _liberar_reserva(envio_id, dono, **valores):
+    db.session.execute(
+        update(AvisoEnvio)
+        .where(AvisoEnvio.id == envio_id, AvisoEnvio.dono == dono)
+        .values(dono=None, ativo_ate=None, **valores)
+    )
+    db.session.commit()
+
+def processar_envio(envio_id, transporte=None):
+    """Entrega um aviso em massa aos destinatários ainda pendentes.
+
+    Os destinatários são lidos do banco em lotes (por cursor de id), enviados
+    em paralelo por um pool limitado de threads e o resultado de cada lote é
+    gravado de uma vez. Só esta função mexe no banco; as threads do pool só
+    falam com o transporte. Pode ser chamada de novo para retomar um envio
+    interrompido. Devolve None se o envio não existe, já terminou ou está com
+    outro processo.
+    """
+    transporte = transporte or transporte_configurado()
+    dono = _dono()
+    if not _reservar_envio(envio_id, dono):
+        return None
+    envio = db.session.get(AvisoEnvio, envio_id)
+
+    mensagem = envio.mensagem
+    tentativas = current_app.config['AVISO_TENTATIVAS']
+    lote = current_app.config['AVISO_LOTE']
+    limitador = LimitadorTaxa(current_app.config['AVISO_TAXA_POR_SEGUNDO'])
+
+    try:
+        with ThreadPoolExecutor(max_workers=current_app.config['AVISO_CONCORRENCIA']) as pool:
+            cursor = 0
+            while True:
+                destinatarios = (db.session.query(AvisoDestinatario.id, AvisoDestinatario.telefone)
+                                 .filter(AvisoDestinatario.envio_id == envio_id,
+                                         AvisoDestinatario.status == 'pendente',
+                                         AvisoDestinatario.id > cursor)
+                                 .order_by(AvisoDestinatario.id)
+                                 .limit(lote)
+                                 .all())
+                if not destinatarios:
+                    break
+                cursor = destinatarios[-1].id
+                # Parou (saída do worker) ou perdeu a reserva: os pendentes ficam
+                # para quem pegar o envio depois.
+                if _parar_avisos.is_set():
+                    _liberar_reserva(envio_id, dono)
+                    return db.session.get(AvisoEnvio, envio_id)
+                if not _renovar_reserva(envio_id, dono):
+                    current_app.logger.warning('Envio de aviso #%s foi retomado por outro processo', envio_id)
+                    return db.session.get(AvisoEnvio, envio_id)
+
+                resultados = pool.map(
+                    lambda d: _enviar_com_retentativas(transporte, limitador, d.telefone, mensagem, tentativas),
+                    destinatarios,
+                )
+
+                agora = datetime.datetime.utcnow()
+                atualizacoes = []
+                enviados = falhas = 0
+                for destinatario, (ok, usadas, erro) in zip(destinatarios, resultados):
+                    atualizacoes.append({
+                        'id': destinatario.id,
+                        'status': 'enviado' if ok else 'falhou',
+                        'tentativas': usadas,
+                        'erro': erro,
+                        'data_envio': agora if ok else None,
+                    })
+                    if ok:
+                        enviados += 1
+                    else:
+                        falhas += 1
+
+                db.session.bulk_update_mappings(AvisoDestinatario, atualizacoes)
+                db.session.execute(
+                    update(AvisoEnvio)
+                    .where(AvisoEnvio.id == envio_id)
+                    .values(enviados=AvisoEnvio.enviados + enviados,
+                            falhas=AvisoEnvio.falhas + falhas)
+                )
+                db.session.commit()
+    except Exception:
+        db.session.rollback()
+        _liberar_reserva(envio_id, dono, status='falhou')
+        raise
+
+    _liberar_reserva(envio_id, dono, status='concluido', data_conclusao=datetime.datetime.utcnow())
+    return db.session.get(AvisoEnvio, envio_id)
+
+def envios_abandonados():
+    """Ids dos envios na fila ou pela metade que nenhum processo está enviando."""
+    return [linha.id for linha in (
+        db.session.query(AvisoEnvio.id)
+        .filter(AvisoEnvio.status.in_(['na_fila', 'enviando']),
+                or_(AvisoEnvio.ativo_ate.is_(None), AvisoEnvio.ativo_ate < datetime.datetime.utcnow()))
+        .order_by(AvisoEnvio.id)
+        .all()
+    )]
+
+def retomar_envios():
+    """Põe na fila deste processo os envios abandonados e devolve quantos.
+
+    Chamada na partida de cada worker e, depois, pela própria thread de envio a
+    cada AVISO_RETOMAR_INTERVALO segundos. Se dois workers acharem o mesmo envio,
+    só um consegue reservá-lo em `processar_envio`.
+    """
+    ids = envios_abandonados()
+    _garantir_trabalhador_avisos()
+    for envio_id in ids:
+        _fila_avisos.put(envio_id)
+    return len(ids)
+
+_fila_avisos = queue.Queue()
+_trabalhador_avisos = None
+_trabalhador_avisos_trava = threading.Lock()
+
+def _loop_avisos(app):
+    intervalo = app.config['AVISO_RETOMAR_INTERVALO'] or None
+    while not _parar_avisos.is_set():
+        try:
+            envio_id = _fila_avisos.get(timeout=intervalo)
+        except queue.Empty:
+            try:
+                with app.app_context():
+                    retomar_envios()
+            except Exception:
+                app.logger.exception('Falha ao procurar avisos em massa abandonados')
+            continue
+        if envio_id is None:
+            # Acordada por `parar_envios`.
+            _fila_avisos.task_done()
+            break
+        try:
+            with app.app_context():
+                processar_envio(envio_id)
+        except Exception:
+            app.logger.exception('Falha no envio de aviso em massa #%s', envio_id)
+        finally:
+            _fila_avisos.task_done()
+
+def _garantir_trabalhador_avisos():
+    global _trabalhador_avisos
+    with _trabalhador_avisos_trava:
+        if _trabalhador_avisos is None or not _trabalhador_avisos.is_alive():
+            _trabalhador_avisos = threading.Thread(target=_loop_avisos, args=(current_app._get_current_object(),),
+                                                   name='envio-avisos', daemon=True)
+            _trabalhador_avisos.start()
+
+def parar_envios(espera=20):
+    """Para a thread de envio depois do lote atual, esperando até `espera` segundos.
+
+    Chamada na saída do worker, antes de o interpretador começar a desligar: sem
+    isso a thread morreria no meio do lote, ou tentaria usar o pool de threads
+    depois do desligamento ("cannot schedule new futures after shutdown").
+    """
+    _parar_avisos.set()
+    _fila_avisos.put(None)
+    trabalhador = _trabalhador_avisos
+    if trabalhador is not None and trabalhador.is_alive():
+        trabalhador.join(espera)
+
+def enfileirar_aviso_todos(mensagem):
+    """Cria o envio, copia os destinatários com um INSERT ... SELECT e enfileira.
+
+    Os destinatários nunca passam pela memória do processo web: o banco copia
+    direto da tabela de usuários, e a requisição volta só com o id do envio.
+    """
+    envio = AvisoEnvio(mensagem=mensagem)
+    db.session.add(envio)
+    db.session.flush()
+
+    resultado = db.session.execute(
+        insert(AvisoDestinatario).from_select(
+            ['envio_id', 'user_id', 'telefone'],
+            select(literal(envio.id), User.id, User.telefone)
+            .where(User.status.in_(['ativo', 'inativo']))
+            .order_by(User.id)
+        )
+    )
+    envio.total = resultado.rowcount
+    db.session.commit()
+
+    _garantir_trabalhador_avisos()
+    _fila_avisos.put(envio.id)
+    return envio
+
+# --- 2. LEMBRETES DE VENCIMENTO ---
+# Uma passada tem duas etapas. Primeiro, um INSERT ... SELECT por tipo cria os
+# lembretes de quem vence na janela, direto no banco: o intervalo de datas usa os
+# índices de (status, data_vencimento), e o NOT EXISTS (mais o índice único)
+# descarta quem já foi lembrado daquele vencimento. Depois, os lembretes
+# pendentes são lidos em lotes pelo id, reservados (pendente -> enviando) com um
+# UPDATE por lote e entregues pelo mesmo transporte, limitador de taxa e
+# retentativas dos avisos em massa. A memória usada é a de um lote, não importa
+# quantos clientes vençam no dia.
+
+def _criar_lembretes(tipo, consulta, agora):
+    """Insere os lembretes que faltam para as linhas de `consulta` e devolve quantos."""
+    ja_lembrado = (select(Lembrete.id)
+                   .where(Lembrete.tipo == tipo,
+                          Lembrete.alvo_id == consulta.selected_columns[0],
+                          Lembrete.data_vencimento == consulta.selected_columns[5])
+                   .exists())
+    resultado = db.session.execute(
+        insert(Lembrete).from_select(
+            ['alvo_id', 'user_id', 'apelido', 'telefone', 'produto', 'data_vencimento', 'tipo', 'status',
+             'tentativas', 'data_criacao'],
+            consulta.add_columns(literal(tipo), literal('pendente'), literal(0), literal(agora, db.DateTime))
+            .where(~ja_lembrado)
+        )
+    )
+    db.session.commit()
+    return resultado.rowcount
+
+def criar_lembretes_vencimento(agora=None, dias=None):
+    """Cria os lembretes de planos e assinaturas que vencem entre agora e agora + `dias`."""
+    agora = agora or datetime.datetime.utcnow()
+    limite = agora + datetime.timedelta(days=dias or current_app.config['LEMBRETE_DIAS'])
+
+    planos = _criar_lembretes('plano', (
+        select(User.id, User.id, User.apelido, User.telefone, User.produto, User.data_vencimento)
+        .where(User.status == 'ativo', User.data_vencimento >= agora, User.data_vencimento < limite)
+    ), agora)
+    assinaturas = _criar_lembretes('assinatura', (
+        select(Assinatura.id, User.id, User.apelido, User.telefone, Assinatura.produto_nome,
+               Assinatura.data_vencimento)
+        .join(User, User.id == Assinatura.user_id)
+        .where(Assinatura.status == 'ativa', Assinatura.data_vencimento >= agora,
+               Assinatura.data_vencimento < limite, User.status.in_(['ativo', 'inativo']))
+    ), agora)
+    return planos, assinaturas
+
+def mensagem_lembrete(lembrete, hoje, modelo=None):
+    return (modelo or current_app.config['LEMBRETE_MENSAGEM']).format(
+        apelido=lembrete.apelido,
+        produto=lembrete.produto,
+        data=lembrete.data_vencimento.strftime('%d/%m/%Y'),
+        dias=max((lembrete.data_vencimento.date() - hoje).days, 0),
+    )
+
+def _reservar_lembretes(ids):
+    """Passa de pendente para enviando os lembretes de `ids` e devolve os que conseguiu.
+
+    Um único UPDATE ... WHERE status = 'pendente' RETURNING reserva o lote
+    inteiro, então com o agendador ligado em vários workers cada lembrete é
+    enviado por um só.
+    """
+    reservados = db.session.execute(
+        update(Lembrete)
+        .where(Lembrete.id.in_(ids), Lembrete.status == 'pendente')
+        .values(status='enviando', data_envio=datetime.datetime.utcnow())
+        .returning(Lembrete.id, Lembrete.apelido, Lembrete.telefone,
+                   Lembrete.produto, Lembrete.data_vencimento)
+    ).all()
+    db.session.commit()
+    return sorted(reservados, key=lambda linha: linha.id)
+
+def _tamanho_lote_lembretes(lote, tentativas):
+    """Limita o lote para ele terminar em até 1/4 do AVISO_PRAZO no limite de taxa.
+
+    Assim a reserva nunca vence (e o lembrete nunca volta para pendente) enquanto
+    o lote ainda está sendo enviado, mesmo que todo envio gaste as tentativas.
+    """
+    taxa = current_app.config['AVISO_TAXA_POR_SEGUNDO']
+    if not taxa:
+        return lote
+    return max(1, min(lote, int(taxa * current_app.config['AVISO_PRAZO'] / (4 * tentativas))))
+
+def _devolver_lembretes_abandonados():
+    """Volta para pendente o que ficou `enviando` além do AVISO_PRAZO (processo que morreu no meio)."""
+    limite = datetime.datetime.utcnow() - datetime.timedelta(seconds=current_app.config['AVISO_PRAZO'])
+    db.session.execute(
+        update(Lembrete)
+        .where(Lembrete.status == 'enviando', Lembrete.data_envio < limite)
+        .values(status='pendente', data_envio=None)
+    )
+    db.session.commit()
+
+def enviar_lembretes_pendentes(transporte=None, lote=None):
+    """Entrega os lembretes pendentes, um lote por vez, e devolve (enviados, falhas)."""
+    transporte = transporte or transporte_configurado()
+    tentativas = current_app.config['AVISO_TENTATIVAS']
+    lote = _tamanho_lote_lembretes(lote or current_app.config['LEMBRETE_LOTE'], tentativas)
+    limitador = LimitadorTaxa(current_app.config['AVISO_TAXA_POR_SEGUNDO'])
+    hoje = datetime.datetime.utcnow().date()
+    # O pool não tem o contexto do app: o texto vai pronto para as threads.
+    modelo = current_app.config['LEMBRETE_MENSAGEM']
+    enviados = falhas = 0
+    _devolver_lembretes_abandonados()
+
+    with ThreadPoolExecutor(max_workers=current_app.config['AVISO_CONCORRENCIA']) as pool:
+        cursor = 0
+        while True:
+            candidatos = (db.session.query(Lembrete.id)
+                          .filter(Lembrete.status == 'pendente', Lembrete.id > cursor)
+                          .order_by(Lembrete.id)
+                          .limit(lote)
+                          .all())
+            if not candidatos:
+                break
+            cursor = candidatos[-1].id
+            pendentes = _reservar_lembretes([linha.id for linha in candidatos])
+            if not pendentes:
+                continue
+
+            resultados = pool.map(
+                lambda l: _enviar_com_retentativas(transporte, limitador, l.telefone,
+                                                   mensagem_lembrete(l, hoje, modelo), tentativas),
+                pendentes,
+            )
+
+            agora = datetime.datetime.utcnow()
+            atualizacoes = []
+            for lembrete, (ok, usadas, erro) in zip(pendentes, resultados):
+                atualizacoes.append({
+                    'id': lembrete.id,
+                    'status': 'enviado' if ok else 'falhou',
+                    'tentativas': usadas,
+                    'erro': erro,
+                    'data_envio': agora if ok else None,
+                })
+                if ok:
+                    enviados += 1
+                else:
+                    falhas += 1
+            db.session.bulk_update_mappings(Lembrete, atualizacoes)
+            db.session.commit()
+    return enviados, falhas
+
+def processar_lembretes(agora=None, dias=None, transporte=None):
+    """Uma passada completa: cria os lembretes da janela e envia os pendentes."""
+    inicio = time.perf_counter()
+    planos, assinaturas = criar_lembretes_vencimento(agora, dias)
+    meio = time.perf_counter()
+    enviados, falhas = enviar_lembretes_pendentes(transporte)
+    fim = time.perf_counter()
+    return {
+        'planos': planos,
+        'assinaturas': assinaturas,
+        'enviados': enviados,
+        'falhas': falhas,
+        'tempo_selecao': meio - inicio,
+        'tempo_envio': fim - meio,
+        'tempo_total': fim - inicio,
+    }
+
+def iniciar_agendador_lembretes(intervalo=None):
+    """Roda `processar_lembretes` em uma thread de fundo a cada `intervalo` segundos.
+
+    Com mais de um worker ligado, o índice único impede lembretes duplicados e a
+    reserva de `_reservar_lembretes` garante que cada um é enviado uma vez.
+    Chamada com o app ativo.
+    """
+    intervalo = intervalo or current_app.config['LEMBRETE_INTERVALO']
+    if not intervalo:
+        return None
+    app = current_app._get_current_object()
+
+    def loop():
+        while True:
+            try:
+                with app.app_context():
+                    resultado = processar_lembretes()
+                if resultado['enviados'] or resultado['falhas']:
+                    app.logger.info('Lembretes: %(enviados)d enviados, %(falhas)d falhas '
+                                    'em %(tempo_total).3fs', resultado)
+            except Exception:
+                app.logger.exception('Falha nos lembretes de vencimento')
+            time.sleep(intervalo)
+
+    thread = threading.Thread(target=loop, name='agendador-lembretes', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,441 @@
+"""Benchmark de carga das rotas principais do app.
+
+Cria um banco sintético com a quantidade pedida de clientes e assinaturas e
+passa pelos fluxos reais (login, painel do cliente, listagem do admin,
+aprovação, nova assinatura e aviso em massa), usando o cliente de testes do
+Flask ou um servidor já rodando (ex.: gunicorn local). O resultado sai em
+JSON com p50/p99, vazão e pico de memória (RSS) para comparar com o limite
+de memória do squarecloud.app.
+
+Exemplos:
+    python benchmark.py --usuarios 100000
+    python benchmark.py --usuarios 1000 --fluxos login,painel_cliente --saida resultado.json
+    python benchmark.py --pasta /tmp/bench --somente-semear
+    RENDER_DISK_MOUNT_PATH=/tmp/bench gunicorn 'app:create_app()' &
+    python benchmark.py --pasta /tmp/bench --sem-semear --url http://127.0.0.1:8000
+    python benchmark.py --usuarios 10000 --comparar-workers sync,gthread,gevent --concorrencia 16
+
+Com --comparar-workers, o benchmark sobe o gunicorn com o gunicorn.conf.py uma
+vez para cada tipo de worker e mede os fluxos (por padrão login e
+painel_cliente) com --concorrencia clientes HTTP ao mesmo tempo, junto com a
+memória total (PSS) do master e dos workers.
+"""
+import argparse
+import datetime
+import http.cookiejar
+import importlib.util
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+FLUXOS = ['login', 'painel_cliente', 'admin_clientes', 'aprovar_usuario', 'adicionar_assinatura', 'aviso_todos']
+FLUXOS_WORKERS = ['login', 'painel_cliente']
+SENHA = 'senha123'
+
+
+def ler_limite_memoria():
+    caminho = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'squarecloud.app')
+    try:
+        with open(caminho) as arquivo:
+            for linha in arquivo:
+                chave, _, valor = linha.strip().partition('=')
+                if chave == 'MEMORY':
+                    return int(valor)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def pico_rss_mb():
+    # No Linux ru_maxrss vem em KiB.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def semear(app_module, app, usuarios, assinaturas_por_usuario, pendentes, lote=10000):
+    """Insere os dados sintéticos em lotes, sem passar pelo ORM.
+
+    Os ids do catálogo (produto_id/plano_id) são resolvidos uma vez antes dos
+    lotes; sem eles os filtros por produto e as métricas por produto viriam vazios.
+    """
+    from werkzeug.security import generate_password_hash
+
+    db = app_module.db
+    User, Assinatura = app_module.User, app_module.Assinatura
+    agora = datetime.datetime.utcnow()
+    hash_senha = generate_password_hash(SENHA, method=app.config['SENHA_METODO'])
+    produtos = [('chatgpt', 'monthly'), ('canva_pro', 'monthly'), ('chatgpt', 'lifetime'), ('canva_pro', 'lifetime')]
+    variacoes = ['mensal', 'trimestral', 'anual', 'vitalicio']
+
+    with app.app_context():
+        app_module.migrar()
+        catalogo = app_module.catalogo
+        ids_produto = {nome: catalogo.id_produto(nome, criar=True) for nome in ('chatgpt', 'canva_pro')}
+        ids_plano = {nome: catalogo.id_plano(nome, criar=True)
+                     for nome in ['monthly', 'lifetime'] + variacoes}
+        for inicio in range(0, usuarios, lote):
+            linhas = []
+            for i in range(inicio, min(inicio + lote, usuarios)):
+                produto, periodo = produtos[i % len(produtos)]
+                linhas.append({
+                    'apelido': f'cliente{i}',
+                    'telefone': f'119{i:08d}',
+                    'email': None,
+                    'password_hash': hash_senha,
+                    'produto': produto,
+                    'periodo': periodo,
+                    'produto_id': ids_produto[produto],
+                    'plano_id': ids_plano[periodo],
+                    'status': 'pendente' if i < pendentes else ('ativo' if i % 5 else 'inativo'),
+                    'data_vencimento': agora + datetime.timedelta(days=(i % 60) - 15) if periodo == 'monthly' else None,
+                    'is_admin': i == pendentes,
+                    'data_criacao': agora - datetime.timedelta(days=i % 400),
+                })
+            db.session.execute(User.__table__.insert(), linhas)
+            db.session.commit()
+
+        total_assinaturas = usuarios * assinaturas_por_usuario
+        for inicio in range(0, total_assinaturas, lote):
+            linhas = []
+            for i in range(inicio, min(inicio + lote, total_assinaturas)):
+                variacao = variacoes[i % len(variacoes)]
+                data_inicio = agora - datetime.timedelta(days=i % 90)
+                produto = 'chatgpt' if i % 2 else 'canva_pro'
+                linhas.append({
+                    'produto_nome': produto,
+                    'variacao': variacao,
+                    'produto_id': ids_produto[produto],
+                    'plano_id': ids_plano[variacao],
+                    'data_inicio': data_inicio,
+                    'data_vencimento': None if variacao == 'vitalicio' else data_inicio + datetime.timedelta(days=30),
+                    'status': 'ativa',
+                    'user_id': (i % usuarios) + 1,
+                })
+            db.session.execute(Assinatura.__table__.insert(), linhas)
+            db.session.commit()
+
+
+class ClienteFlask:
+    """Dispara as requisições pelo cliente de testes do Flask, no mesmo processo."""
+
+    def __init__(self, app):
+        self.app = app
+        self.cliente = app.test_client()
+
+    def requisitar(self, metodo, caminho, dados=None, cabecalhos=None, ip=None):
+        ambiente = {'REMOTE_ADDR': ip} if ip else {}
+        resposta = self.cliente.open(caminho, method=metodo, data=dados, headers=cabecalhos,
+                                     environ_base=ambiente)
+        return resposta.status_code
+
+    def logar_como(self, user_id, telefone):
+        # Abre a sessão direto no banco, sem pagar o hash de senha do /login.
+        from app import criar_sessao
+        with self.app.app_context():
+            token = criar_sessao(user_id)
+        with self.cliente.session_transaction() as sessao:
+            sessao['sessao'] = token
+
+
+class ClienteHttp:
+    """Dispara as requisições contra um servidor rodando (ex.: gunicorn local)."""
+
+    class _SemRedirecionar(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.cookies = http.cookiejar.CookieJar()
+        self.abridor = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(self.cookies), self._SemRedirecionar)
+
+    def requisitar(self, metodo, caminho, dados=None, cabecalhos=None, ip=None):
+        corpo = urllib.parse.urlencode(dados).encode() if dados else None
+        pedido = urllib.request.Request(self.url + caminho, data=corpo, method=metodo,
+                                        headers=cabecalhos or {})
+        try:
+            with self.abridor.open(pedido) as resposta:
+                resposta.read()
+                return resposta.status
+        except urllib.error.HTTPError as erro:
+            return erro.code
+
+    def logar_como(self, user_id, telefone):
+        self.requisitar('POST', '/login', {'telefone': telefone, 'senha': SENHA})
+
+
+def medir(nome, iteracoes, passos):
+    """Roda `iteracoes` passos divididos entre as threads (um passo, com seu cliente, por thread)."""
+    latencias = []
+    erros = [0]
+    trava = threading.Lock()
+
+    def trabalhar(passo, primeiro):
+        for i in range(primeiro, iteracoes, len(passos)):
+            t0 = time.perf_counter()
+            status = passo(i)
+            duracao = time.perf_counter() - t0
+            with trava:
+                latencias.append(duracao)
+                if status >= 500:
+                    erros[0] += 1
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=trabalhar, args=(passo, n)) for n, passo in enumerate(passos)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+    latencias.sort()
+    return {
+        'fluxo': nome,
+        'iteracoes': iteracoes,
+        'concorrencia': len(passos),
+        'erros': erros[0],
+        'p50_ms': statistics.median(latencias) * 1000,
+        'p99_ms': latencias[min(len(latencias) - 1, int(len(latencias) * 0.99))] * 1000,
+        'max_ms': latencias[-1] * 1000,
+        'vazao_rps': iteracoes / duracao if duracao else None,
+        'pico_rss_mb': pico_rss_mb(),
+    }
+
+
+def rodar_fluxos(clientes, fluxos, usuarios, pendentes, iteracoes):
+    """Mede cada fluxo com todos os `clientes` disparando ao mesmo tempo."""
+    aleatorio = random.Random(42)
+    # Índices 0..pendentes-1 são pendentes, o índice `pendentes` é o admin e,
+    # depois dele, quem tem índice múltiplo de 5 está inativo.
+    ativos = [i for i in range(pendentes + 1, usuarios) if i % 5]
+
+    def telefone(indice):
+        return f'119{indice:08d}'
+
+    def ip_aleatorio():
+        return f'10.{aleatorio.randrange(256)}.{aleatorio.randrange(256)}.{aleatorio.randrange(1, 255)}'
+
+    def montar_passo(cliente, fluxo):
+        if fluxo == 'login':
+            def passo(i):
+                indice = aleatorio.choice(ativos)
+                return cliente.requisitar('POST', '/login', {'telefone': telefone(indice), 'senha': SENHA},
+                                          ip=ip_aleatorio())
+            n = iteracoes
+        elif fluxo == 'painel_cliente':
+            indice = ativos[0]
+            cliente.logar_como(indice + 1, telefone(indice))
+
+            def passo(i):
+                return cliente.requisitar('GET', '/painel')
+            n = iteracoes
+        elif fluxo == 'admin_clientes':
+            def passo(i):
+                return cliente.requisitar('GET', '/admin/clientes')
+            n = iteracoes
+        elif fluxo == 'aprovar_usuario':
+            def passo(i):
+                return cliente.requisitar('GET', f'/admin/aprovar/{i + 1}')
+            n = min(iteracoes, pendentes)
+        elif fluxo == 'adicionar_assinatura':
+            def passo(i):
+                user_id = aleatorio.choice(ativos) + 1
+                return cliente.requisitar('POST', f'/admin/adicionar-assinatura/{user_id}', {
+                    'produto_nome': 'chatgpt', 'variation': 'mensal',
+                    'start_date': datetime.date.today().strftime('%Y-%m-%d'),
+                })
+            n = iteracoes
+        elif fluxo == 'aviso_todos':
+            def passo(i):
+                return cliente.requisitar('POST', '/admin/aviso-todos', {'mensagem': f'benchmark {i}'},
+                                          {'Accept': 'application/json'})
+            n = max(1, iteracoes // 50)
+        else:
+            raise SystemExit(f'Fluxo desconhecido: {fluxo}')
+        return passo, n
+
+    resultados = []
+    for fluxo in fluxos:
+        montados = [montar_passo(cliente, fluxo) for cliente in clientes]
+        n = montados[0][1]
+        if n:
+            resultado = medir(fluxo, n, [passo for passo, _ in montados])
+            resultados.append(resultado)
+            print(f"{fluxo:<22} p50 {resultado['p50_ms']:8.1f} ms  p99 {resultado['p99_ms']:8.1f} ms  "
+                  f"{resultado['vazao_rps']:8.1f} req/s  RSS {resultado['pico_rss_mb']:.0f} MB",
+                  file=sys.stderr)
+    return resultados
+
+
+def porta_livre():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _pai(pid):
+    try:
+        with open(f'/proc/{pid}/stat') as arquivo:
+            return int(arquivo.read().rsplit(')', 1)[1].split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def memoria_processos_mb(pid):
+    """PSS somado do processo e dos filhos: as páginas divididas pelo fork contam uma vez só."""
+    filhos = [int(p) for p in os.listdir('/proc') if p.isdigit() and _pai(p) == pid]
+    total_kb = 0
+    for processo in [pid] + filhos:
+        try:
+            with open(f'/proc/{processo}/smaps_rollup') as arquivo:
+                total_kb += sum(int(linha.split()[1]) for linha in arquivo if linha.startswith('Pss:'))
+        except OSError:
+            pass
+    return total_kb / 1024, len(filhos)
+
+
+def comparar_workers(classes, pasta, fluxos, usuarios, pendentes, iteracoes, concorrencia):
+    """Sobe o gunicorn (gunicorn.conf.py) com cada tipo de worker e mede os fluxos por HTTP."""
+    raiz = os.path.dirname(os.path.abspath(__file__))
+    resultados = []
+    for classe in classes:
+        if classe == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print('gevent não está instalado; pulando.', file=sys.stderr)
+            continue
+
+        url = f'http://127.0.0.1:{porta_livre()}'
+        # Todas as requisições saem do mesmo IP: com o limite de tentativas
+        # ligado, o login mediria só as recusas.
+        ambiente = dict(os.environ, RENDER_DISK_MOUNT_PATH=pasta, GUNICORN_WORKER_CLASS=classe,
+                        PORT=url.rsplit(':', 1)[1], LIMITE_ARMAZEM='0')
+        caminho_log = os.path.join(pasta, f'gunicorn-{classe}.log')
+        with open(caminho_log, 'w') as log:
+            servidor = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+                                         'app:create_app()'],
+                                        cwd=raiz, env=ambiente, stdout=log, stderr=log)
+        try:
+            limite_espera = time.monotonic() + 60
+            while True:
+                try:
+                    if ClienteHttp(url).requisitar('GET', '/login') == 200:
+                        break
+                except urllib.error.URLError:
+                    pass
+                if servidor.poll() is not None or time.monotonic() > limite_espera:
+                    raise SystemExit(f'O gunicorn ({classe}) não subiu; veja {caminho_log}.')
+                time.sleep(0.2)
+
+            print(f'--- {classe} ---', file=sys.stderr)
+            clientes = [ClienteHttp(url) for _ in range(concorrencia)]
+            medidos = rodar_fluxos(clientes, fluxos, usuarios, pendentes, iteracoes)
+            memoria, workers = memoria_processos_mb(servidor.pid)
+            print(f'{classe}: {workers} workers, {memoria:.0f} MB (PSS)', file=sys.stderr)
+            resultados.append({
+                'worker_class': classe,
+                'workers': workers,
+                'memoria_servidor_mb': memoria,
+                'fluxos': medidos,
+            })
+        finally:
+            servidor.terminate()
+            servidor.wait(timeout=60)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--usuarios', type=int, default=1000, help='Clientes sintéticos (1k a 1M).')
+    parser.add_argument('--assinaturas-por-usuario', type=int, default=1)
+    parser.add_argument('--pendentes', type=int, default=None,
+                        help='Quantos clientes começam pendentes (padrão: 1%% dos usuários).')
+    parser.add_argument('--iteracoes', type=int, default=200, help='Requisições por fluxo.')
+    parser.add_argument('--fluxos', default=None,
+                        help='Fluxos separados por vírgula (padrão: todos; com --comparar-workers, '
+                             'login e painel_cliente).')
+    parser.add_argument('--pasta', default=None, help='Pasta do database.db (padrão: pasta temporária).')
+    parser.add_argument('--url', default=None, help='Usa um servidor rodando em vez do cliente de testes.')
+    parser.add_argument('--concorrencia', type=int, default=1, help='Clientes disparando ao mesmo tempo.')
+    parser.add_argument('--comparar-workers', default=None, metavar='CLASSES',
+                        help='Sobe o gunicorn com cada tipo de worker (ex.: sync,gthread,gevent) e compara.')
+    parser.add_argument('--sem-semear', action='store_true', help='Usa o banco que já está na pasta.')
+    parser.add_argument('--somente-semear', action='store_true', help='Só cria o banco e sai.')
+    parser.add_argument('--saida', default=None, help='Arquivo para gravar o JSON (padrão: stdout).')
+    args = parser.parse_args()
+
+    pendentes = args.pendentes if args.pendentes is not None else max(1, args.usuarios // 100)
+    pasta = args.pasta or tempfile.mkdtemp(prefix='achadinhos-bench-')
+    os.makedirs(pasta, exist_ok=True)
+    # O app lê a pasta do banco na importação e a configuração na create_app().
+    os.environ['RENDER_DISK_MOUNT_PATH'] = pasta
+    os.environ.setdefault('AVISO_TAXA_POR_SEGUNDO', '0')
+
+    import app as app_module
+    from avisos import TransporteStub
+
+    app = app_module.create_app()
+    app.config['AVISO_TRANSPORTE'] = TransporteStub()
+
+    inicio = time.perf_counter()
+    if not args.sem_semear:
+        semear(app_module, app, args.usuarios, args.assinaturas_por_usuario, pendentes)
+    tempo_semeadura = time.perf_counter() - inicio
+    print(f'Banco em {pasta} ({tempo_semeadura:.1f}s para semear)', file=sys.stderr)
+    if args.somente_semear:
+        return
+
+    fluxos = args.fluxos.split(',') if args.fluxos else (FLUXOS_WORKERS if args.comparar_workers else FLUXOS)
+    fluxos = [f.strip() for f in fluxos if f.strip()]
+    limite = ler_limite_memoria()
+
+    if args.comparar_workers:
+        classes = [c.strip() for c in args.comparar_workers.split(',') if c.strip()]
+        servidores = comparar_workers(classes, pasta, fluxos, args.usuarios, pendentes,
+                                      args.iteracoes, args.concorrencia)
+        for servidor in servidores:
+            servidor['dentro_do_limite'] = None if limite is None else servidor['memoria_servidor_mb'] <= limite
+        relatorio = {
+            'usuarios': args.usuarios,
+            'assinaturas_por_usuario': args.assinaturas_por_usuario,
+            'modo': 'gunicorn',
+            'concorrencia': args.concorrencia,
+            'segundos_semeadura': tempo_semeadura,
+            'limite_memoria_mb': limite,
+            'servidores': servidores,
+        }
+    else:
+        if args.url:
+            clientes = [ClienteHttp(args.url) for _ in range(args.concorrencia)]
+        else:
+            clientes = [ClienteFlask(app) for _ in range(args.concorrencia)]
+        resultados = rodar_fluxos(clientes, fluxos, args.usuarios, pendentes, args.iteracoes)
+        relatorio = {
+            'usuarios': args.usuarios,
+            'assinaturas_por_usuario': args.assinaturas_por_usuario,
+            'modo': 'http' if args.url else 'test_client',
+            'concorrencia': args.concorrencia,
+            'segundos_semeadura': tempo_semeadura,
+            'pico_rss_mb': pico_rss_mb(),
+            'limite_memoria_mb': limite,
+            'dentro_do_limite': None if limite is None or args.url else pico_rss_mb() <= limite,
+            'fluxos': resultados,
+        }
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, 'w') as arquivo:
+            arquivo.write(texto + '\n')
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
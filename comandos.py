@@ -0,0 +1,466 @@
+"""Comandos do `flask` (manutenção, migrações, benchmarks e build).
+
+O app só importa este módulo quando a linha de comando pede um comando (veja
+`ComandosSobDemanda` no app.py); os workers web nunca carregam nada daqui. Os
+comandos de avisos, exportação e build importam seus módulos dentro da função,
+para que um `flask migrate` não pague por eles.
+"""
+import datetime
+import multiprocessing
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import create_engine, event, insert, select, text, update
+from sqlalchemy.exc import OperationalError
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import (
+    db, User, AvisoEnvio, AvisoDestinatario, Lembrete, DATA_DIR, MIGRACOES, CONSULTAS_EXEMPLO,
+    aplicar_pragmas_sqlite, copiar_de_sqlite, descrever_comando, expirar_vencidos, medir_metodo_senha,
+    metodo_senha_atual, migrar, simular_migracoes, versao_atual_esquema,
+    _busca_clientes, _consulta_fts, _match_fts,
+)
+
+# --- 1. COMANDOS DE LINHA DE COMANDO ---
+# O `app.cli` de cada app copia os comandos deste grupo na primeira vez que o
+# `flask` pede um. Eles rodam com o app ativo (current_app).
+cli = AppGroup('comandos')
+
+@cli.command("init-db")
+def init_db_command():
+    """Cria as tabelas do banco de dados."""
+    migrar()
+    print("Banco de dados inicializado.")
+
+@cli.command("migrate")
+@click.option('--dry-run', is_flag=True, help='Só mostra o que seria feito e os planos de consulta.')
+def migrate_command(dry_run):
+    """Aplica as migrações pendentes do esquema."""
+    if dry_run:
+        pendentes, antes, depois, novas = simular_migracoes()
+        if novas:
+            print(f"Tabelas novas: {', '.join(novas)}")
+        if not pendentes and not novas:
+            print(f"Esquema já está na versão {MIGRACOES[-1][0]}.")
+            return
+        for versao, nome, comandos in pendentes:
+            print(f"[{versao}] {nome}")
+            for comando in comandos:
+                print(f"    {descrever_comando(comando)}")
+        print()
+        for nome, _ in CONSULTAS_EXEMPLO:
+            print(f"{nome}:")
+            print(f"    antes:  {antes[nome]}")
+            print(f"    depois: {depois[nome]}")
+        return
+
+    aplicadas = migrar()
+    for versao, nome in aplicadas:
+        print(f"Migração {versao} aplicada: {nome}")
+    print(f"Esquema na versão {versao_atual_esquema()}.")
+
+@cli.command("copiar-sqlite")
+@click.argument('origem', type=click.Path(dir_okay=False))
+@click.option('--lote', default=1000, help='Linhas por INSERT (e por transação).')
+def copiar_sqlite_command(origem, lote):
+    """Copia um banco SQLite existente para o banco de DATABASE_URL."""
+    def progresso(tabela, total):
+        print(f"\r{tabela}: {total} linhas", end='', flush=True)
+
+    copiadas = copiar_de_sqlite(origem, lote=lote, progresso=progresso)
+    print()
+    for tabela, total in copiadas.items():
+        print(f"{tabela}: {total} linhas copiadas")
+
+@cli.command("expirar-vencidos")
+@click.option('--lote', default=None, type=int, help='Quantidade de linhas por UPDATE.')
+def expirar_vencidos_command(lote):
+    """Desativa usuários e assinaturas vencidos e apaga as sessões vencidas."""
+    resultado = expirar_vencidos(lote=lote)
+    print(f"Usuários desativados: {resultado['usuarios']} ({resultado['tempo_usuarios']:.3f}s)")
+    print(f"Assinaturas desativadas: {resultado['assinaturas']} ({resultado['tempo_assinaturas']:.3f}s)")
+    print(f"Sessões vencidas apagadas: {resultado['sessoes']} ({resultado['tempo_sessoes']:.3f}s)")
+    print(f"Tempo total: {resultado['tempo_total']:.3f}s")
+
+@cli.command("benchmark-senha")
+@click.option('--metodo', 'metodos', multiple=True,
+              help='Método a medir (pode repetir). Padrão: alguns candidatos comuns.')
+@click.option('--repeticoes', default=20, help='Verificações por método.')
+def benchmark_senha_command(metodos, repeticoes):
+    """Mede logins por segundo, por núcleo, para cada configuração de hash."""
+    metodos = metodos or (
+        'scrypt',
+        'scrypt:16384:8:1',
+        'pbkdf2:sha256:600000',
+        'pbkdf2:sha256:260000',
+        'pbkdf2:sha256:100000',
+    )
+    print(f"Configurado: {current_app.config['SENHA_METODO']} ({metodo_senha_atual()})")
+    for metodo in metodos:
+        por_segundo = medir_metodo_senha(metodo, repeticoes)
+        print(f"{metodo:<24} {por_segundo:8.1f} logins/s por núcleo ({1000 / por_segundo:.1f} ms cada)")
+
+def _trabalhador_benchmark_sqlite(url, ajustes, inicio_ids, operacoes, resultados):
+    engine = create_engine(url)
+    if ajustes:
+        event.listen(engine, 'connect', lambda conexao, registro: aplicar_pragmas_sqlite(conexao))
+    tabela = User.__table__
+    ok = travados = 0
+    for i in range(operacoes):
+        user_id = inicio_ids + i
+        agora = datetime.datetime.utcnow()
+        try:
+            with engine.begin() as conexao:
+                if i % 4 == 0:
+                    conexao.execute(update(tabela)
+                                    .where(tabela.c.id == user_id, tabela.c.status == 'pendente')
+                                    .values(status='ativo', data_vencimento=agora + datetime.timedelta(days=30)))
+                elif i % 4 == 1:
+                    conexao.execute(update(tabela)
+                                    .where(tabela.c.id == user_id)
+                                    .values(data_vencimento=agora + datetime.timedelta(days=7)))
+                elif i % 4 == 2:
+                    linha = conexao.execute(select(tabela.c.password_hash)
+                                            .where(tabela.c.telefone == str(user_id))).first()
+                    check_password_hash(linha[0], 'senha')
+                else:
+                    # Leitura longa, como a listagem de clientes do admin.
+                    for _ in conexao.execute(select(tabela).where(tabela.c.status == 'ativo').limit(2000)):
+                        pass
+            ok += 1
+        except OperationalError:
+            travados += 1
+    engine.dispose()
+    resultados.put((ok, travados))
+
+@cli.command("benchmark-sqlite")
+@click.option('--workers', default=8, help='Processos escrevendo ao mesmo tempo.')
+@click.option('--operacoes', default=300,
+              help='Operações por processo (aprovar/adicionar dias/login/listar clientes).')
+@click.option('--pasta', default=DATA_DIR, help='Onde criar os bancos temporários (use o mesmo disco da produção).')
+def benchmark_sqlite_command(workers, operacoes, pasta):
+    """Compara a vazão de escrita concorrente com e sem os ajustes do SQLite."""
+    contexto = multiprocessing.get_context('fork')
+    hash_senha = generate_password_hash('senha', method='pbkdf2:sha256:1000')
+    total = workers * operacoes
+
+    for ajustes in (False, True):
+        pasta_banco = tempfile.mkdtemp(dir=pasta)
+        url = 'sqlite:///' + os.path.join(pasta_banco, 'benchmark.db')
+        engine = create_engine(url)
+        if ajustes:
+            event.listen(engine, 'connect', lambda conexao, registro: aplicar_pragmas_sqlite(conexao))
+        db.metadata.create_all(engine)
+        with engine.begin() as conexao:
+            conexao.execute(insert(User.__table__), [
+                {'apelido': f'bench{i}', 'telefone': str(i), 'password_hash': hash_senha,
+                 'produto': 'chatgpt', 'periodo': 'monthly', 'status': 'pendente', 'is_admin': False}
+                for i in range(1, total + 1)
+            ])
+        engine.dispose()
+
+        resultados = contexto.Queue()
+        processos = [
+            contexto.Process(target=_trabalhador_benchmark_sqlite,
+                             args=(url, ajustes, 1 + n * operacoes, operacoes, resultados))
+            for n in range(workers)
+        ]
+        inicio = time.perf_counter()
+        for processo in processos:
+            processo.start()
+        parciais = [resultados.get() for _ in processos]
+        for processo in processos:
+            processo.join()
+        duracao = time.perf_counter() - inicio
+
+        ok = sum(p[0] for p in parciais)
+        travados = sum(p[1] for p in parciais)
+        nome = 'ajustado (WAL)' if ajustes else 'padrão'
+        print(f"{nome:<15} {ok / duracao:8.0f} operações/s  {ok} ok, {travados} 'database is locked' "
+              f"em {duracao:.2f}s")
+        shutil.rmtree(pasta_banco, ignore_errors=True)
+
+@cli.command("benchmark-busca")
+@click.option('--clientes', default=500000, help='Clientes sintéticos no banco temporário.')
+@click.option('--consultas', default=200, help='Buscas medidas.')
+@click.option('--pasta', default=DATA_DIR, help='Onde criar o banco temporário.')
+def benchmark_busca_command(clientes, consultas, pasta):
+    """Mede a latência do autocompletar de clientes (índice FTS5 trigram) num banco grande."""
+    pasta_banco = tempfile.mkdtemp(dir=pasta)
+    engine = create_engine('sqlite:///' + os.path.join(pasta_banco, 'benchmark.db'))
+    event.listen(engine, 'connect', lambda conexao, registro: aplicar_pragmas_sqlite(conexao))
+    db.metadata.create_all(engine)
+    comandos = dict((versao, c) for versao, _, c in MIGRACOES)[2]['sqlite']
+
+    produtos = ['chatgpt', 'canva_pro', 'other']
+    nomes = ['ana', 'bruno', 'carla', 'diego', 'elisa', 'fabio', 'gabriela', 'heitor', 'iris', 'joao']
+    inicio = time.perf_counter()
+    with engine.begin() as conexao:
+        for comando in comandos:
+            conexao.execute(text(comando))
+        tabela = User.__table__
+        for base in range(0, clientes, 10000):
+            conexao.execute(insert(tabela), [
+                {'apelido': f'{nomes[i % len(nomes)]}{i}', 'telefone': f'119{i:08d}',
+                 'email': f'cliente{i}@exemplo.com', 'password_hash': 'x',
+                 'produto': produtos[i % len(produtos)], 'periodo': 'monthly',
+                 'status': 'ativo' if i % 3 else 'inativo', 'is_admin': False}
+                for i in range(base, min(base + 10000, clientes))
+            ])
+    print(f"{clientes} clientes indexados em {time.perf_counter() - inicio:.1f}s")
+
+    aleatorio = random.Random(42)
+    buscas = []
+    for _ in range(consultas):
+        i = aleatorio.randrange(clientes)
+        buscas.append(aleatorio.choice([
+            f'{nomes[i % len(nomes)]}{i}'[:aleatorio.randint(3, 8)],
+            f'{i:08d}'[-aleatorio.randint(4, 8):],
+            f'cliente{i}@',
+            produtos[i % len(produtos)][:4],
+        ]))
+
+    tempos = []
+    with engine.connect() as conexao:
+        for busca in buscas:
+            consulta = (select(User.__table__.c.id, User.__table__.c.apelido)
+                        .join(_busca_clientes, _busca_clientes.c.rowid == User.id)
+                        .where(_match_fts(_consulta_fts(busca)), User.status.in_(['ativo', 'inativo']))
+                        .order_by(_busca_clientes.c.rowid)
+                        .limit(10))
+            inicio = time.perf_counter()
+            conexao.execute(consulta).all()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+    engine.dispose()
+    shutil.rmtree(pasta_banco, ignore_errors=True)
+
+    tempos.sort()
+    p50 = tempos[len(tempos) // 2]
+    p99 = tempos[min(len(tempos) - 1, int(len(tempos) * 0.99))]
+    print(f"{consultas} buscas: p50 {p50:.2f} ms, p99 {p99:.2f} ms, máx. {tempos[-1]:.2f} ms")
+
+@cli.command("exportar-clientes")
+@click.argument('destino', type=click.File('w', encoding='utf-8'))
+@click.option('--formato', type=click.Choice(['csv', 'ndjson']), default='csv')
+@click.option('--com-senhas', is_flag=True, help='Inclui os hashes de senha (para migrar de servidor).')
+def exportar_clientes_command(destino, formato, com_senhas):
+    """Exporta clientes e assinaturas para um arquivo CSV ou NDJSON."""
+    from exportacao import exportar_csv, exportar_ndjson
+    gerador = exportar_ndjson if formato == 'ndjson' else exportar_csv
+    for pedaco in gerador(com_senhas=com_senhas):
+        destino.write(pedaco)
+
+@cli.command("importar-clientes")
+@click.argument('origem', type=click.Path(exists=True, dir_okay=False))
+@click.option('--lote', default=1000, help='Linhas validadas e gravadas por vez.')
+@click.option('--processos', default=None, type=int, help='Processos para gerar hash de senhas.')
+def importar_clientes_command(origem, lote, processos):
+    """Importa clientes e assinaturas de um CSV ou NDJSON exportado."""
+    from exportacao import importar_clientes, _leitor_por_nome
+    inicio = time.perf_counter()
+    with open(origem, encoding='utf-8-sig', newline='') as arquivo:
+        resultado = importar_clientes(_leitor_por_nome(origem)(arquivo), lote=lote, processos=processos,
+                                      confiavel=True)
+    duracao = time.perf_counter() - inicio
+
+    print(f"{resultado['usuarios']} clientes e {resultado['assinaturas']} assinaturas importados "
+          f"em {duracao:.1f}s.")
+    for numero, motivo in resultado['erros'][:20]:
+        print(f"  linha {numero}: {motivo}")
+    if len(resultado['erros']) > 20:
+        print(f"  ... e mais {len(resultado['erros']) - 20} linhas com erro.")
+
+@cli.command("processar-avisos")
+def processar_avisos_command():
+    """Retoma envios em massa que ficaram na fila, pela metade ou falharam com destinatários pendentes."""
+    from avisos import processar_envio
+    tem_pendentes = (select(AvisoDestinatario.id)
+                     .where(AvisoDestinatario.envio_id == AvisoEnvio.id,
+                            AvisoDestinatario.status == 'pendente')
+                     .exists())
+    envios = (AvisoEnvio.query
+              .filter(AvisoEnvio.status.in_(['na_fila', 'enviando'])
+                      | ((AvisoEnvio.status == 'falhou') & tem_pendentes))
+              .order_by(AvisoEnvio.id)
+              .all())
+    for envio in envios:
+        resultado = processar_envio(envio.id)
+        if resultado is None:
+            print(f"Envio #{envio.id}: em andamento em outro processo.")
+            continue
+        print(f"Envio #{resultado.id}: {resultado.enviados} enviados, {resultado.falhas} falhas.")
+
+@cli.command("benchmark-aviso")
+@click.option('--destinatarios', default=10000, help='Quantidade de destinatários sintéticos.')
+@click.option('--latencia', default=0.005, help='Latência simulada por envio, em segundos.')
+@click.option('--taxa-falha', default=0.0, help='Fração de envios que falham no transporte stub.')
+@click.option('--concorrencia', default=None, type=int, help='Threads de envio (padrão: AVISO_CONCORRENCIA).')
+@click.option('--taxa', default=0.0, help='Limite de envios por segundo (0 = sem limite).')
+def benchmark_aviso_command(destinatarios, latencia, taxa_falha, concorrencia, taxa):
+    """Mede a vazão do pipeline de avisos com o transporte stub, sem rede."""
+    from avisos import TransporteStub, processar_envio
+    if concorrencia:
+        current_app.config['AVISO_CONCORRENCIA'] = concorrencia
+    current_app.config['AVISO_TAXA_POR_SEGUNDO'] = taxa
+
+    envio = AvisoEnvio(mensagem='benchmark', total=destinatarios)
+    db.session.add(envio)
+    db.session.flush()
+    db.session.execute(insert(AvisoDestinatario), [
+        {'envio_id': envio.id, 'telefone': f'bench{i}'} for i in range(destinatarios)
+    ])
+    db.session.commit()
+
+    inicio = time.perf_counter()
+    envio = processar_envio(envio.id, TransporteStub(latencia=latencia, taxa_falha=taxa_falha))
+    duracao = time.perf_counter() - inicio
+
+    print(f"{envio.enviados} enviados, {envio.falhas} falhas em {duracao:.2f}s "
+          f"({destinatarios / duracao:.0f} destinatários/s)")
+
+    AvisoDestinatario.query.filter_by(envio_id=envio.id).delete()
+    db.session.delete(envio)
+    db.session.commit()
+
+@cli.command("processar-lembretes")
+@click.option('--dias', default=None, type=int, help='Janela de vencimento em dias (padrão: LEMBRETE_DIAS).')
+def processar_lembretes_command(dias):
+    """Cria e envia os lembretes de quem vence nos próximos dias."""
+    from avisos import processar_lembretes
+    resultado = processar_lembretes(dias=dias)
+    print(f"Lembretes novos: {resultado['planos']} de planos, {resultado['assinaturas']} de assinaturas "
+          f"({resultado['tempo_selecao']:.3f}s)")
+    print(f"Enviados: {resultado['enviados']}, falhas: {resultado['falhas']} ({resultado['tempo_envio']:.3f}s)")
+
+@cli.command("benchmark-lembretes")
+@click.option('--clientes', default=100000, help='Clientes sintéticos vencendo dentro da janela.')
+@click.option('--latencia', default=0.0, help='Latência simulada por envio, em segundos.')
+def benchmark_lembretes_command(clientes, latencia):
+    """Mede uma passada de lembretes (tempo e pico de memória). Use com um banco vazio."""
+    from avisos import TransporteStub, processar_lembretes
+    if db.session.query(User.id).first():
+        raise click.ClickException('O banco já tem usuários; aponte DATABASE_URL para um banco vazio.')
+    current_app.config['AVISO_TAXA_POR_SEGUNDO'] = 0
+
+    agora = datetime.datetime.utcnow()
+    janela = current_app.config['LEMBRETE_DIAS'] * 86400
+    for base in range(0, clientes, 10000):
+        db.session.execute(insert(User), [
+            {'apelido': f'bench{i}', 'telefone': f'bench{i}', 'password_hash': 'x', 'produto': 'chatgpt',
+             'periodo': 'monthly', 'status': 'ativo', 'is_admin': False,
+             'data_vencimento': agora + datetime.timedelta(seconds=60 + i * janela // (clientes * 2))}
+            for i in range(base, min(base + 10000, clientes))
+        ])
+        db.session.commit()
+
+    tracemalloc.start()
+    resultado = processar_lembretes(agora=agora, transporte=TransporteStub(latencia=latencia))
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    segunda = processar_lembretes(agora=agora, transporte=TransporteStub())
+
+    print(f"{resultado['planos']} lembretes criados em {resultado['tempo_selecao']:.2f}s, "
+          f"{resultado['enviados']} enviados em {resultado['tempo_envio']:.2f}s "
+          f"({resultado['enviados'] / resultado['tempo_envio']:.0f}/s)")
+    print(f"Pico de memória: {pico / 1024 / 1024:.1f} MiB")
+    print(f"Segunda passada (deduplicação): {segunda['planos']} novos em {segunda['tempo_total']:.3f}s")
+
+    Lembrete.query.delete()
+    User.query.filter(User.telefone.like('bench%')).delete(synchronize_session=False)
+    db.session.commit()
+
+@cli.command("build-assets")
+def build_assets_command():
+    """Gera CSS, Alpine e fontes com hash no nome para servir em /assets."""
+    from assets import gerar_assets
+    manifesto = gerar_assets()
+    pasta = current_app.config['ASSETS_DIR']
+    for nome, arquivo in manifesto.items():
+        tamanhos = [f"{os.path.getsize(os.path.join(pasta, arquivo)) / 1024:.1f} KB"]
+        for extensao in ('.gz', '.br'):
+            if os.path.exists(os.path.join(pasta, arquivo + extensao)):
+                tamanhos.append(f"{extensao[1:]} {os.path.getsize(os.path.join(pasta, arquivo + extensao)) / 1024:.1f} KB")
+        print(f"{nome} -> {arquivo} ({', '.join(tamanhos)})")
+
+def _ler_importtime(saida):
+    """Lê a saída do `python -X importtime`: [(nível, módulo, próprio µs, acumulado µs)]."""
+    linhas = []
+    for linha in saida.splitlines():
+        if not linha.startswith('import time:') or 'imported package' in linha:
+            continue
+        proprio, acumulado, nome = linha[len('import time:'):].split('|')
+        nivel = (len(nome) - len(nome.lstrip(' ')) - 1) // 2
+        linhas.append((nivel, nome.strip(), int(proprio), int(acumulado)))
+    return linhas
+
+@cli.command("perfil-importacao")
+@click.option('--modulo', default='app', help='Módulo importado.')
+@click.option('--repeticoes', default=5, help='Importações medidas (vale a mediana).')
+@click.option('--top', default=15, help='Linhas em cada tabela.')
+@click.option('--fabrica/--sem-fabrica', default=True,
+              help='Também chama create_app() e mede o tempo dela (e o que ela importa).')
+def perfil_importacao_command(modulo, repeticoes, top, fabrica):
+    """Mostra quanto cada módulo custa na importação do app (python -X importtime)."""
+    # Os agendadores ficam de fora: a medida é só da partida.
+    ambiente = dict(os.environ, ADIAR_AGENDADORES='1')
+    codigo = f'import {modulo}'
+    if fabrica:
+        codigo += (f'; import time; inicio = time.perf_counter(); {modulo}.create_app(); '
+                   f'print(time.perf_counter() - inicio)')
+    execucoes, fabricas = [], []
+    for _ in range(repeticoes):
+        resultado = subprocess.run([sys.executable, '-X', 'importtime', '-c', codigo],
+                                   cwd=current_app.root_path, env=ambiente, capture_output=True, text=True)
+        if resultado.returncode:
+            raise click.ClickException(resultado.stderr.strip().splitlines()[-1])
+        execucoes.append(_ler_importtime(resultado.stderr))
+        if fabrica:
+            fabricas.append(float(resultado.stdout.split()[-1]) * 1000)
+
+    def mediana(valores):
+        return statistics.median(valores) / 1000
+
+    proprio, acumulado, pacotes, diretos = {}, {}, {}, {}
+    for linhas in execucoes:
+        por_pacote = {}
+        for i, (nivel, nome, us_proprio, us_acumulado) in enumerate(linhas):
+            proprio.setdefault(nome, []).append(us_proprio)
+            acumulado.setdefault(nome, []).append(us_acumulado)
+            pacote = nome.split('.')[0]
+            por_pacote[pacote] = por_pacote.get(pacote, 0) + us_proprio
+            if nome == modulo and nivel == 0:
+                # Os filhos de `modulo` vêm antes dele, com um nível a mais.
+                for filho_nivel, filho, _, filho_acumulado in reversed(linhas[:i]):
+                    if filho_nivel == 0:
+                        break
+                    if filho_nivel == 1:
+                        diretos.setdefault(filho, []).append(filho_acumulado)
+        for pacote, total in por_pacote.items():
+            pacotes.setdefault(pacote, []).append(total)
+
+    if modulo not in acumulado:
+        raise click.ClickException(f'{modulo} não aparece na saída do importtime.')
+    total = mediana(acumulado[modulo])
+    print(f"import {modulo}: {total:.1f} ms (mediana de {repeticoes}), "
+          f"{mediana(proprio[modulo]):.1f} ms no próprio módulo")
+    if fabrica:
+        print(f"{modulo}.create_app(): {statistics.median(fabricas):.1f} ms (mediana, com o que ela importa)")
+
+    def tabela(titulo, itens):
+        print(f"\n{titulo:<40} {'ms':>8} {'%':>6}")
+        for nome, valores in sorted(itens.items(), key=lambda item: -mediana(item[1]))[:top]:
+            ms = mediana(valores)
+            print(f"{nome:<40} {ms:>8.1f} {ms / total * 100:>5.1f}%")
+
+    tabela(f'Importados por {modulo} (acumulado)', diretos)
+    tabela('Por pacote (tempo próprio somado)', pacotes)
@@ -0,0 +1,402 @@
+"""Exportação e importação de clientes em massa (CSV e NDJSON).
+
+Carregado sob demanda pelas rotas /admin/exportar e /admin/importar e pelos
+comandos `exportar-clientes` e `importar-clientes`.
+"""
+import contextlib
+import csv
+import datetime
+import io
+import json
+import os
+import queue
+import re
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from sqlalchemy import or_, update
+from werkzeug.security import generate_password_hash
+
+from app import db, User, Assinatura, Importacao, DATA_DIR, catalogo, invalidar_metricas
+
+# --- 1. EXPORTAÇÃO E IMPORTAÇÃO EM MASSA ---
+
+CAMPOS_USUARIO = ['apelido', 'telefone', 'email', 'produto', 'periodo', 'status',
+                  'data_vencimento', 'data_criacao', 'is_admin']
+# Os hashes de senha só saem pelo comando `exportar-clientes --com-senhas`, nunca pela web.
+CAMPOS_SENHA = ['password_hash']
+CAMPOS_ASSINATURA = ['produto_nome', 'variacao', 'data_inicio', 'data_vencimento', 'status']
+
+def _campos_usuario(com_senhas):
+    return CAMPOS_USUARIO + CAMPOS_SENHA if com_senhas else CAMPOS_USUARIO
+
+def _valor_exportado(valor):
+    if isinstance(valor, datetime.datetime):
+        return valor.isoformat()
+    return valor
+
+def _linhas_exportacao(campos_usuario, lote=1000):
+    """Percorre usuários e assinaturas (LEFT JOIN) em ordem, lendo `lote` linhas por vez.
+
+    Seleciona só colunas, sem montar objetos do ORM, para a memória ficar
+    constante mesmo com milhões de linhas.
+    """
+    colunas_usuario = [getattr(User, campo) for campo in campos_usuario]
+    colunas_assinatura = [getattr(Assinatura, campo).label('assinatura_' + campo) for campo in CAMPOS_ASSINATURA]
+    consulta = (db.session.query(User.id, Assinatura.id.label('assinatura_id'),
+                                 *colunas_usuario, *colunas_assinatura)
+                .outerjoin(Assinatura, Assinatura.user_id == User.id)
+                .order_by(User.id, Assinatura.id)
+                .execution_options(yield_per=lote))
+    for linha in consulta:
+        usuario = {campo: _valor_exportado(getattr(linha, campo)) for campo in campos_usuario}
+        assinatura = None
+        if linha.assinatura_id is not None:
+            assinatura = {campo: _valor_exportado(getattr(linha, 'assinatura_' + campo))
+                          for campo in CAMPOS_ASSINATURA}
+        yield linha.id, usuario, assinatura
+
+def exportar_csv(com_senhas=False):
+    campos_usuario = _campos_usuario(com_senhas)
+    saida = io.StringIO()
+    escritor = csv.writer(saida)
+    escritor.writerow(campos_usuario + ['assinatura_' + campo for campo in CAMPOS_ASSINATURA])
+    yield saida.getvalue()
+    for _, usuario, assinatura in _linhas_exportacao(campos_usuario):
+        saida.seek(0)
+        saida.truncate()
+        assinatura = assinatura or {}
+        escritor.writerow([usuario[c] for c in campos_usuario] + [assinatura.get(c) for c in CAMPOS_ASSINATURA])
+        yield saida.getvalue()
+
+def exportar_ndjson(com_senhas=False):
+    """Um objeto JSON por usuário, com as assinaturas aninhadas."""
+    atual_id, atual = None, None
+    for user_id, usuario, assinatura in _linhas_exportacao(_campos_usuario(com_senhas)):
+        if user_id != atual_id:
+            if atual is not None:
+                yield json.dumps(atual, ensure_ascii=False) + '\n'
+            atual_id, atual = user_id, dict(usuario, assinaturas=[])
+        if assinatura is not None:
+            atual['assinaturas'].append(assinatura)
+    if atual is not None:
+        yield json.dumps(atual, ensure_ascii=False) + '\n'
+
+def ler_csv(arquivo):
+    """Converte as linhas do CSV exportado para o formato aninhado do NDJSON.
+
+    O CSV tem uma linha por assinatura; linhas seguidas do mesmo telefone
+    são juntadas num único cliente.
+    """
+    atual = None
+    for linha in csv.DictReader(arquivo):
+        assinatura = {campo: linha.get('assinatura_' + campo) for campo in CAMPOS_ASSINATURA}
+        if atual is not None and linha.get('telefone') == atual['telefone']:
+            if assinatura.get('produto_nome'):
+                atual['assinaturas'].append(assinatura)
+            continue
+        if atual is not None:
+            yield atual
+        atual = {campo: linha.get(campo) for campo in CAMPOS_USUARIO + CAMPOS_SENHA + ['senha']}
+        atual['assinaturas'] = [assinatura] if assinatura.get('produto_nome') else []
+    if atual is not None:
+        yield atual
+
+def ler_ndjson(arquivo):
+    for linha in arquivo:
+        if linha.strip():
+            yield json.loads(linha)
+
+def _data_importada(valor):
+    if not valor:
+        return None
+    if isinstance(valor, datetime.datetime):
+        return valor
+    try:
+        return datetime.datetime.fromisoformat(valor)
+    except ValueError:
+        return datetime.datetime.strptime(valor, '%d/%m/%Y')
+
+def _gerar_hash(argumentos):
+    senha, metodo = argumentos
+    return generate_password_hash(senha, method=metodo)
+
+def _validar_usuario(registro, telefones, apelidos, confiavel=False):
+    apelido = (registro.get('apelido') or '').strip()
+    telefone = re.sub(r'\D', '', str(registro.get('telefone') or ''))
+    if not apelido or not telefone or not registro.get('produto'):
+        raise ValueError('apelido, telefone e produto são obrigatórios')
+    if registro.get('password_hash') and not confiavel:
+        raise ValueError('password_hash só é aceito pelo comando importar-clientes; envie a senha')
+    if not registro.get('password_hash') and not registro.get('senha'):
+        raise ValueError('informe senha ou password_hash')
+    if telefone in telefones:
+        raise ValueError(f'telefone {telefone} já cadastrado')
+    if apelido in apelidos:
+        raise ValueError(f'apelido {apelido} já em uso')
+
+    status = registro.get('status') or 'pendente'
+    if status not in ('pendente', 'ativo', 'inativo'):
+        raise ValueError(f'status inválido: {status}')
+
+    usuario = {
+        'apelido': apelido,
+        'telefone': telefone,
+        'email': registro.get('email') or None,
+        'produto': registro['produto'],
+        'periodo': registro.get('periodo') or 'monthly',
+        'status': status,
+        'data_vencimento': _data_importada(registro.get('data_vencimento')),
+        'data_criacao': _data_importada(registro.get('data_criacao')) or datetime.datetime.utcnow(),
+        'is_admin': confiavel and str(registro.get('is_admin')).lower() in ('1', 'true', 'sim'),
+        'password_hash': registro.get('password_hash') or None,
+    }
+    assinaturas = [{
+        'produto_nome': a['produto_nome'],
+        'variacao': a.get('variacao') or None,
+        'data_inicio': _data_importada(a.get('data_inicio')) or datetime.datetime.utcnow(),
+        'data_vencimento': _data_importada(a.get('data_vencimento')),
+        'status': a.get('status') or 'ativa',
+    } for a in registro.get('assinaturas') or [] if a.get('produto_nome')]
+    return usuario, assinaturas
+
+def _gravar_lote_importacao(lote, pool):
+    metodo = current_app.config['SENHA_METODO']
+    sem_hash = [(usuario, senha) for usuario, senha, _ in lote if not usuario['password_hash']]
+    if sem_hash:
+        hashes = pool.map(_gerar_hash, [(senha, metodo) for _, senha in sem_hash], chunksize=16)
+        for (usuario, _), hash_senha in zip(sem_hash, hashes):
+            usuario['password_hash'] = hash_senha
+
+    for usuario, _, lista in lote:
+        usuario['produto_id'] = catalogo.id_produto(usuario['produto'], criar=True)
+        usuario['plano_id'] = catalogo.id_plano(usuario['periodo'], criar=True)
+        for assinatura in lista:
+            assinatura['produto_id'] = catalogo.id_produto(assinatura['produto_nome'], criar=True)
+            assinatura['plano_id'] = catalogo.id_plano(assinatura['variacao'], criar=True)
+
+    db.session.bulk_insert_mappings(User, [usuario for usuario, _, _ in lote])
+    ids = dict(db.session.query(User.telefone, User.id)
+               .filter(User.telefone.in_([usuario['telefone'] for usuario, _, _ in lote])))
+    assinaturas = [dict(assinatura, user_id=ids[usuario['telefone']])
+                   for usuario, _, lista in lote for assinatura in lista]
+    if assinaturas:
+        db.session.bulk_insert_mappings(Assinatura, assinaturas)
+    db.session.commit()
+    return len(assinaturas)
+
+class _HashEmSerie:
+    """Faz o papel do pool de processos quando não dá para criar processos (importação pela web)."""
+
+    def map(self, funcao, itens, chunksize=1):
+        return map(funcao, itens)
+
+def importar_clientes(registros, lote=1000, processos=None, confiavel=False, inicio=0, progresso=None):
+    """Importa clientes (e as assinaturas de cada um) validando em lotes.
+
+    Telefones e apelidos existentes são carregados uma vez num set, senhas
+    em texto são transformadas em hash num pool de processos (em série com
+    `processos=0`) e cada lote entra com `bulk_insert_mappings`. Linhas
+    inválidas são puladas e voltam em `erros` como (número da linha, motivo).
+    As colunas `is_admin` e `password_hash` só valem com `confiavel` (comando
+    de linha de comando); pela web todo cliente entra sem acesso de
+    administrador e com a senha informada.
+
+    Os `inicio` primeiros registros são pulados (retomada). Depois de cada lote
+    gravado, `progresso(linhas, resultado)` recebe o número do último registro
+    lido; se devolver False, a importação para ali e `interrompida` vem True.
+    """
+    telefones = {linha[0] for linha in db.session.query(User.telefone)}
+    apelidos = {linha[0] for linha in db.session.query(User.apelido)}
+    resultado = {'usuarios': 0, 'assinaturas': 0, 'erros': [], 'interrompida': False}
+    pendente = []
+
+    def gravar(numero):
+        if pendente:
+            resultado['assinaturas'] += _gravar_lote_importacao(pendente, pool)
+            resultado['usuarios'] += len(pendente)
+            pendente.clear()
+        return progresso is None or progresso(numero, resultado) is not False
+
+    if processos == 0:
+        executor = contextlib.nullcontext(_HashEmSerie())
+    else:
+        executor = ProcessPoolExecutor(max_workers=processos)
+    with executor as pool:
+        numero = inicio
+        for numero, registro in enumerate(registros, start=1):
+            if numero <= inicio:
+                continue
+            try:
+                usuario, assinaturas = _validar_usuario(registro, telefones, apelidos, confiavel)
+            except (ValueError, KeyError, TypeError) as e:
+                resultado['erros'].append((numero, str(e)))
+                continue
+            telefones.add(usuario['telefone'])
+            apelidos.add(usuario['apelido'])
+            pendente.append((usuario, registro.get('senha'), assinaturas))
+
+            if len(pendente) >= lote and not gravar(numero):
+                resultado['interrompida'] = True
+                break
+        else:
+            gravar(numero)
+
+    invalidar_metricas()
+    return resultado
+
+def _leitor_por_nome(nome_arquivo):
+    return ler_ndjson if nome_arquivo.lower().endswith(('.ndjson', '.jsonl', '.json')) else ler_csv
+
+# --- 2. IMPORTAÇÃO PELA WEB EM SEGUNDO PLANO ---
+# O upload é gravado no disco e importado por uma thread do worker, como os
+# avisos em massa: a importação fica reservada ao processo que a pegou (renovada
+# a cada lote), para na saída do worker e é retomada do último lote gravado por
+# quem a achar abandonada.
+
+PASTA_IMPORTACOES = os.path.join(DATA_DIR, 'importacoes')
+_parar = threading.Event()
+_fila_importacoes = queue.Queue()
+_trabalhador = None
+_trabalhador_trava = threading.Lock()
+
+def _dono():
+    return f'{socket.gethostname()}:{os.getpid()}'[:64]
+
+def _prazo():
+    return datetime.datetime.utcnow() + datetime.timedelta(seconds=current_app.config['AVISO_PRAZO'])
+
+def _reservar(importacao_id, dono):
+    agora = datetime.datetime.utcnow()
+    resultado = db.session.execute(
+        update(Importacao)
+        .where(Importacao.id == importacao_id,
+               Importacao.status.in_(['na_fila', 'importando']),
+               or_(Importacao.ativo_ate.is_(None), Importacao.ativo_ate < agora))
+        .values(status='importando', dono=dono, ativo_ate=_prazo())
+    )
+    db.session.commit()
+    return resultado.rowcount == 1
+
+def _liberar(importacao_id, dono, **valores):
+    db.session.execute(
+        update(Importacao)
+        .where(Importacao.id == importacao_id, Importacao.dono == dono)
+        .values(dono=None, ativo_ate=None, **valores)
+    )
+    db.session.commit()
+
+def _apagar_arquivo(caminho):
+    with contextlib.suppress(OSError):
+        os.remove(caminho)
+
+def enfileirar_importacao(arquivo):
+    """Grava o upload (um FileStorage) no disco, cria a importação e a enfileira."""
+    importacao = Importacao(nome=os.path.basename(arquivo.filename)[:255])
+    db.session.add(importacao)
+    db.session.flush()
+    os.makedirs(PASTA_IMPORTACOES, exist_ok=True)
+    extensao = '.ndjson' if _leitor_por_nome(arquivo.filename) is ler_ndjson else '.csv'
+    importacao.arquivo = os.path.join(PASTA_IMPORTACOES, f'{importacao.id}{extensao}')
+    arquivo.save(importacao.arquivo)
+    db.session.commit()
+
+    _garantir_trabalhador()
+    _fila_importacoes.put(importacao.id)
+    return importacao
+
+def processar_importacao(importacao_id):
+    """Importa (ou continua importando) um upload. Devolve None se outro processo está com ele."""
+    dono = _dono()
+    if not _reservar(importacao_id, dono):
+        return None
+    importacao = db.session.get(Importacao, importacao_id)
+    caminho, inicio = importacao.arquivo, importacao.linhas
+    anteriores = (importacao.usuarios, importacao.assinaturas, importacao.erros)
+    primeiros = json.loads(importacao.primeiros_erros or '[]')
+
+    def progresso(linhas, resultado):
+        erros = resultado['erros']
+        db.session.execute(
+            update(Importacao)
+            .where(Importacao.id == importacao_id, Importacao.dono == dono)
+            .values(linhas=linhas, ativo_ate=_prazo(),
+                    usuarios=anteriores[0] + resultado['usuarios'],
+                    assinaturas=anteriores[1] + resultado['assinaturas'],
+                    erros=anteriores[2] + len(erros),
+                    primeiros_erros=json.dumps((primeiros + erros)[:20], ensure_ascii=False))
+        )
+        db.session.commit()
+        return not _parar.is_set()
+
+    try:
+        with open(caminho, encoding='utf-8-sig', newline='') as arquivo:
+            resultado = importar_clientes(_leitor_por_nome(caminho)(arquivo), lote=current_app.config['IMPORTACAO_LOTE'],
+                                          processos=0, inicio=inicio, progresso=progresso)
+    except Exception as e:
+        db.session.rollback()
+        _liberar(importacao_id, dono, status='falhou', falha=str(e)[:255])
+        _apagar_arquivo(caminho)
+        raise
+
+    if resultado['interrompida']:
+        _liberar(importacao_id, dono)
+    else:
+        _liberar(importacao_id, dono, status='concluida', data_conclusao=datetime.datetime.utcnow())
+        _apagar_arquivo(caminho)
+    return db.session.get(Importacao, importacao_id)
+
+def retomar_importacoes():
+    """Põe na fila deste processo as importações abandonadas e devolve quantas."""
+    ids = [linha.id for linha in (
+        db.session.query(Importacao.id)
+        .filter(Importacao.status.in_(['na_fila', 'importando']),
+                or_(Importacao.ativo_ate.is_(None), Importacao.ativo_ate < datetime.datetime.utcnow()))
+        .order_by(Importacao.id)
+        .all()
+    )]
+    _garantir_trabalhador()
+    for importacao_id in ids:
+        _fila_importacoes.put(importacao_id)
+    return len(ids)
+
+def _loop_importacoes(app):
+    intervalo = app.config['AVISO_RETOMAR_INTERVALO'] or None
+    while not _parar.is_set():
+        try:
+            importacao_id = _fila_importacoes.get(timeout=intervalo)
+        except queue.Empty:
+            try:
+                with app.app_context():
+                    retomar_importacoes()
+            except Exception:
+                app.logger.exception('Falha ao procurar importações abandonadas')
+            continue
+        if importacao_id is None:
+            _fila_importacoes.task_done()
+            break
+        try:
+            with app.app_context():
+                processar_importacao(importacao_id)
+        except Exception:
+            app.logger.exception('Falha na importação #%s', importacao_id)
+        finally:
+            _fila_importacoes.task_done()
+
+def _garantir_trabalhador():
+    global _trabalhador
+    with _trabalhador_trava:
+        if _trabalhador is None or not _trabalhador.is_alive():
+            _trabalhador = threading.Thread(target=_loop_importacoes, args=(current_app._get_current_object(),),
+                                            name='importacoes', daemon=True)
+            _trabalhador.start()
+
+def parar_importacoes(espera=20):
+    """Para a thread de importação depois do lote atual (saída do worker)."""
+    _parar.set()
+    _fila_importacoes.put(None)
+    trabalhador = _trabalhador
+    if trabalhador is not None and trabalhador.is_alive():
+        trabalhador.join(espera)
@@ -0,0 +1,122 @@
+"""Configuração do gunicorn para produção.
+
+    gunicorn -c gunicorn.conf.py 'app:create_app()'
+
+Os workers e threads saem do número de núcleos e do limite de memória do
+squarecloud.app (ou de MEMORIA_MB). Tudo pode ser trocado por variáveis de
+ambiente:
+
+    GUNICORN_WORKER_CLASS   sync, gthread (padrão) ou gevent
+    WEB_CONCURRENCY         número de workers (padrão: calculado)
+    GUNICORN_THREADS        threads por worker no gthread (padrão: 4)
+    GUNICORN_CONEXOES       conexões simultâneas por worker no gevent (padrão: 100)
+    GUNICORN_MB_POR_WORKER  memória estimada de cada worker (padrão: 80)
+    GUNICORN_MAX_REQUESTS   requisições até reciclar o worker (padrão: 1000)
+    PORT                    porta (padrão: 8080, a mesma do `python app.py`)
+
+Com mais de um worker, o cache de páginas e os limites de tentativas passam a
+usar o SQLite compartilhado (CACHE_PAGINAS=sqlite e LIMITE_ARMAZEM=sqlite), a
+não ser que essas variáveis já estejam definidas.
+
+O gevent só ajuda quando o tempo vai em espera de rede (avisos, Postgres com
+psycogreen); consultas ao SQLite e o hash de senha seguram o worker inteiro.
+"""
+import multiprocessing
+import os
+import sys
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+if worker_class == 'gevent':
+    try:
+        from gevent import monkey
+    except ImportError:
+        print('gevent não está instalado; usando gthread.', file=sys.stderr)
+        worker_class = 'gthread'
+    else:
+        # Com preload_app o app é montado aqui no master, antes de o worker
+        # gevent aplicar o patch; sem isso, as travas e threads criadas na
+        # importação e na create_app() continuariam bloqueantes.
+        monkey.patch_all()
+        try:
+            from psycogreen.gevent import patch_psycopg
+        except ImportError:
+            pass
+        else:
+            patch_psycopg()
+
+# O master monta o app uma vez e os workers nascem por fork, dividindo a
+# memória já carregada. As threads de fundo só sobem depois do fork.
+preload_app = True
+os.environ.setdefault('ADIAR_AGENDADORES', '1')
+
+
+def limite_memoria_mb():
+    if os.environ.get('MEMORIA_MB'):
+        return int(os.environ['MEMORIA_MB'])
+    caminho = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'squarecloud.app')
+    try:
+        with open(caminho) as arquivo:
+            for linha in arquivo:
+                chave, _, valor = linha.strip().partition('=')
+                if chave == 'MEMORY':
+                    return int(valor)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def calcular_workers():
+    """2 x núcleos + 1 (um por núcleo no gevent), sem passar do limite de memória."""
+    nucleos = multiprocessing.cpu_count()
+    por_nucleos = nucleos + 1 if worker_class == 'gevent' else nucleos * 2 + 1
+    limite = limite_memoria_mb()
+    if limite is None:
+        return por_nucleos
+    # Sobra para o master, que também fica com o app carregado.
+    mb_por_worker = int(os.environ.get('GUNICORN_MB_POR_WORKER', 80))
+    return max(1, min(por_nucleos, (limite - mb_por_worker) // mb_por_worker))
+
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+workers = int(os.environ.get('WEB_CONCURRENCY') or calcular_workers())
+threads = int(os.environ.get('GUNICORN_THREADS', 4)) if worker_class == 'gthread' else 1
+worker_connections = int(os.environ.get('GUNICORN_CONEXOES', 100))
+
+# O cache de páginas em memória só é invalidado no worker que fez a escrita; com
+# mais de um worker os outros serviriam páginas antigas até o TTL vencer. Os
+# limites de tentativas em memória, por sua vez, ficariam multiplicados pelo
+# número de workers.
+if workers > 1:
+    os.environ.setdefault('CACHE_PAGINAS', 'sqlite')
+    os.environ.setdefault('LIMITE_ARMAZEM', 'sqlite')
+
+# Recicla cada worker depois de N requisições (com um sorteio para não
+# reiniciarem todos juntos), limitando vazamentos e fragmentação de memória.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+# O batimento dos workers vai para a memória, não para o disco do container.
+if os.path.isdir('/dev/shm'):
+    worker_tmp_dir = '/dev/shm'
+
+
+# Com preload_app, server.app.wsgi() devolve o app que o master já montou com a
+# create_app(); os workers herdam esse mesmo objeto no fork.
+def on_starting(server):
+    from app import antes_dos_workers
+    antes_dos_workers(server.app.wsgi())
+    server.log.info('%s workers %s (%s threads, limite %s MB)', workers, worker_class,
+                    threads, limite_memoria_mb())
+
+
+def post_fork(server, worker):
+    from app import apos_fork
+    apos_fork(server.app.wsgi())
+
+
+def worker_exit(server, worker):
+    from app import antes_de_sair
+    antes_de_sair()
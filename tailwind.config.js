@@ -0,0 +1,55 @@
+// Configuração usada pelo `flask build-assets` para gerar o CSS final.
+// As cores, fontes e raios vêm de variáveis CSS que cada template define
+// no próprio <head>, assim um único arquivo atende todas as paletas.
+module.exports = {
+  darkMode: 'class',
+  content: ['./templates/**/*.html'],
+  theme: {
+    extend: {
+      colors: {
+        'primary': 'rgb(var(--cor-primary) / <alpha-value>)',
+        'primary-light': 'rgb(var(--cor-primary-light) / <alpha-value>)',
+        'primary-dark': 'rgb(var(--cor-primary-dark) / <alpha-value>)',
+        'primary-light-bg': 'rgb(var(--cor-primary-light-bg) / <alpha-value>)',
+        'background-light': 'rgb(var(--cor-background-light) / <alpha-value>)',
+        'background-dark': 'rgb(var(--cor-background-dark) / <alpha-value>)',
+        'surface-light': 'rgb(var(--cor-surface-light) / <alpha-value>)',
+        'surface-dark': 'rgb(var(--cor-surface-dark) / <alpha-value>)',
+        'card-light': 'rgb(var(--cor-card-light) / <alpha-value>)',
+        'card-dark': 'rgb(var(--cor-card-dark) / <alpha-value>)',
+        'border-light': 'rgb(var(--cor-border-light) / <alpha-value>)',
+        'border-dark': 'rgb(var(--cor-border-dark) / <alpha-value>)',
+        'text-light': 'rgb(var(--cor-text-light) / <alpha-value>)',
+        'text-dark': 'rgb(var(--cor-text-dark) / <alpha-value>)',
+        'text-light-primary': 'rgb(var(--cor-text-light-primary) / <alpha-value>)',
+        'text-light-secondary': 'rgb(var(--cor-text-light-secondary) / <alpha-value>)',
+        'text-dark-primary': 'rgb(var(--cor-text-dark-primary) / <alpha-value>)',
+        'text-dark-secondary': 'rgb(var(--cor-text-dark-secondary) / <alpha-value>)',
+        'text-muted-light': 'rgb(var(--cor-text-muted-light) / <alpha-value>)',
+        'text-muted-dark': 'rgb(var(--cor-text-muted-dark) / <alpha-value>)',
+        'pending': 'rgb(var(--cor-pending) / <alpha-value>)',
+        'active': 'rgb(var(--cor-active) / <alpha-value>)',
+        'expired': 'rgb(var(--cor-expired) / <alpha-value>)',
+        'success': 'rgb(var(--cor-success) / <alpha-value>)',
+        'danger': 'rgb(var(--cor-danger) / <alpha-value>)',
+        // Estas duas já vêm com transparência (rgba), então não aceitam /opacidade
+        'success-bg': 'var(--cor-success-bg)',
+        'danger-bg': 'var(--cor-danger-bg)',
+      },
+      fontFamily: {
+        display: ['var(--fonte-display, sans-serif)'],
+        sans: ['var(--fonte-sans, ui-sans-serif, system-ui, sans-serif)'],
+      },
+      borderRadius: {
+        DEFAULT: 'var(--raio, 0.25rem)',
+        lg: 'var(--raio-lg, 0.5rem)',
+        xl: 'var(--raio-xl, 0.75rem)',
+        full: 'var(--raio-full, 9999px)',
+      },
+    },
+  },
+  plugins: [
+    require('@tailwindcss/forms'),
+    require('@tailwindcss/container-queries'),
+  ],
+}